@@ -9,6 +9,7 @@ Functions:
     create_signal_handler(): Create signal handler for a received signal.
     frame_norm(): Convert relative bounding box coordinates (0-1) to pixel coordinates.
     make_bbox_square(): Adjust bounding box dimensions to make it square.
+    crop_bbox(): Crop bounding box area from frame.
     zip_data(): Store data in an uncompressed .zip file for each day and delete original directory.
 
 frame_norm() is based on open source scripts available at https://github.com/luxonis
@@ -31,8 +32,11 @@ def create_signal_handler(external_shutdown):
 
 
 def frame_norm(frame, bbox):
-    """Convert relative bounding box coordinates (0-1) to pixel coordinates."""
-    norm_vals = np.full(len(bbox), frame.shape[0])
+    """Convert relative bounding box coordinates (0-1) to pixel coordinates.
+
+    Multiple bounding boxes can be converted at once by passing them as sequence of bboxes.
+    """
+    norm_vals = np.full(np.shape(bbox)[-1], frame.shape[0])
     norm_vals[::2] = frame.shape[1]
 
     return (np.clip(np.array(bbox), 0, 1) * norm_vals).astype(int)
@@ -72,6 +76,18 @@ def make_bbox_square(frame, bbox):
     return bbox
 
 
+def crop_bbox(frame, bbox, crop="square"):
+    """Crop bounding box area from frame.
+
+    Optionally adjust bounding box dimensions to make it square before cropping.
+    Return a copy of the cropped area, so that the frame can be modified afterwards.
+    """
+    if crop == "square":
+        bbox = make_bbox_square(frame, bbox.copy())
+
+    return frame[bbox[1]:bbox[3], bbox[0]:bbox[2]].copy()
+
+
 def zip_data(save_path):
     """Store data in an uncompressed .zip file for each day and delete original directory."""
     with ZipFile(f"{save_path.parent}.zip", "a") as zip_file:
@@ -91,8 +91,10 @@ def record_log(rec_id, rec_start, rec_start_format, rec_end, save_path,
     """
     try:
         df_meta = pd.read_csv(save_path / f"{rec_start_format}_metadata.csv", encoding="utf-8")
+        num_crops = len(df_meta)  # one row per cropped detection (.jpg can be stored in .zip file)
         unique_ids = df_meta["track_ID"].nunique()
     except (pd.errors.EmptyDataError, FileNotFoundError):
+        num_crops = 0
         unique_ids = 0
 
     logs_rec = {
@@ -100,7 +102,7 @@ def record_log(rec_id, rec_start, rec_start_format, rec_end, save_path,
         "rec_start": rec_start.isoformat(),
         "rec_end": rec_end.isoformat(),
         "rec_time_min": round((rec_end - rec_start).total_seconds() / 60, 2),
-        "num_crops": len(list((save_path / "crop").glob("**/*.jpg"))),
+        "num_crops": num_crops,
         "num_IDs": unique_ids,
         "disk_free_gb": round(psutil.disk_usage("/").free / 1073741824, 1)
     }
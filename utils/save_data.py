@@ -6,7 +6,9 @@ Author:   Maximilian Sittinger (https://github.com/maxsitt)
 Docs:     https://maxsitt.github.io/insect-detect-docs/
 
 Functions:
+    save_jpg(): Save frame to .jpg file or store it in an opened .zip file.
     save_crop_metadata(): Save cropped detection to .jpg and corresponding metadata to .csv.
+    flush_metadata(): Write buffered metadata to the opened .csv file.
     save_full_frame(): Save full frame to .jpg.
     save_overlay_frame(): Save full frame with overlays to .jpg.
 
@@ -14,23 +16,58 @@ partly based on open source scripts available at https://github.com/luxonis
 """
 
 import csv
+import threading
 from datetime import datetime
+from pathlib import Path
 
 import cv2
 
-from utils.general import make_bbox_square
-
-
-def save_crop_metadata(frame, bbox, rec_id, label, det_conf, track_id, bbox_orig,
-                       rec_start_format, save_path, crop="square"):
-    """Save cropped detection to .jpg and corresponding metadata to .csv."""
-    timestamp = datetime.now()
-    if crop == "square":
-        bbox = make_bbox_square(frame, bbox.copy())
-    bbox_crop = frame[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+# Column names of the metadata .csv file
+METADATA_FIELDS = ("rec_ID", "timestamp", "label", "confidence", "track_ID",
+                   "x_min", "y_min", "x_max", "y_max", "file_path")
+
+# Lock to write metadata from multiple threads to the same .csv file
+metadata_lock = threading.Lock()
+
+# Lock to write to (or read from) the same .zip file from multiple threads
+zip_lock = threading.Lock()
+
+
+def save_jpg(path, frame, zip_file=None):
+    """Save frame to .jpg file or store it in an opened .zip file.
+
+    If the frame is already JPEG-encoded (1D buffer, e.g. from the
+    OAK video encoder), write it without re-encoding.
+    If zip_file is provided, store the .jpg with its path relative to
+    the directory that contains the .zip file (= directory of the day).
+    """
+    if zip_file is None:
+        if frame.ndim == 1:
+            frame.tofile(path)
+        else:
+            cv2.imwrite(path, frame)
+    else:
+        if frame.ndim != 1:
+            frame = cv2.imencode(".jpg", frame)[1]
+        arcname = Path(path).relative_to(Path(zip_file.filename).parent)
+        with zip_lock:
+            zip_file.writestr(arcname.as_posix(), frame.tobytes())
+
+
+def save_crop_metadata(bbox_crop, crop_dir, rec_id, label, det_conf, track_id, bbox_orig,
+                       rec_start_format, save_path, metadata_file=None, zip_file=None,
+                       timestamp=None):
+    """Save cropped detection to .jpg and corresponding metadata to .csv.
+
+    Save the .jpg to crop_dir (stored in zip_file, if provided) and name it with
+    timestamp (e.g. shared by all detections of a frame, default: current time).
+    If metadata_file is provided, write metadata to this opened .csv file (header
+    already written) instead of opening the .csv file in save_path.
+    """
+    timestamp = datetime.now() if timestamp is None else timestamp
     timestamp_crop = timestamp.strftime("%Y-%m-%d_%H-%M-%S-%f")
-    path_crop = f"{save_path}/crop/{label}/{timestamp_crop}_ID{track_id}_crop.jpg"
-    cv2.imwrite(path_crop, bbox_crop)
+    path_crop = f"{crop_dir}/{timestamp_crop}_ID{track_id}_crop.jpg"
+    save_jpg(path_crop, bbox_crop, zip_file)
 
     metadata = {
         "rec_ID": rec_id,
@@ -45,37 +82,54 @@ def save_crop_metadata(frame, bbox, rec_id, label, det_conf, track_id, bbox_orig
         "file_path": path_crop
     }
 
-    with open(save_path / f"{rec_start_format}_metadata.csv", "a", encoding="utf-8") as metadata_file:
-        metadata_writer = csv.DictWriter(metadata_file, fieldnames=metadata.keys())
-        if metadata_file.tell() == 0:
-            metadata_writer.writeheader()
-        metadata_writer.writerow(metadata)
+    if metadata_file is None:
+        with metadata_lock, open(save_path / f"{rec_start_format}_metadata.csv", "a",
+                                 encoding="utf-8") as metadata_file:
+            metadata_writer = csv.DictWriter(metadata_file, fieldnames=METADATA_FIELDS)
+            if metadata_file.tell() == 0:
+                metadata_writer.writeheader()
+            metadata_writer.writerow(metadata)
+    else:
+        # Don't call tell() on the opened file, as it would flush its write buffer
+        with metadata_lock:
+            csv.DictWriter(metadata_file, fieldnames=METADATA_FIELDS).writerow(metadata)
+
 
+def flush_metadata(metadata_file):
+    """Write buffered metadata to the opened .csv file."""
+    with metadata_lock:
+        metadata_file.flush()
 
-def save_full_frame(frame, save_path):
-    """Save full frame to .jpg."""
+
+def save_full_frame(frame, save_path, zip_file=None, timestamp=None):
+    """Save full frame to .jpg (optionally stored in an opened .zip file)."""
     if frame is not None:
-        timestamp_full = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+        timestamp = datetime.now() if timestamp is None else timestamp
+        timestamp_full = timestamp.strftime("%Y-%m-%d_%H-%M-%S-%f")
         path_full = f"{save_path}/full/{timestamp_full}_full.jpg"
-        cv2.imwrite(path_full, frame)
+        save_jpg(path_full, frame, zip_file)
+
 
+def save_overlay_frame(frame, overlays, save_path, res_4k=False, zip_file=None, timestamp=None):
+    """Save full frame with overlays to .jpg (optionally stored in an opened .zip file).
 
-def save_overlay_frame(frame, bbox, label, det_conf, track_id,
-                       tracklet, tracks, save_path, res_4k=False):
-    """Save full frame with overlays to .jpg."""
+    Draw overlays (bbox + info) of all detections, provided as list of
+    (bbox, label, det_conf, track_id) tuples, and save the frame once.
+    """
     text_pos = (48, 98, 164) if res_4k else (28, 55, 92)
     font_size = (1.7, 1.6, 2) if res_4k else (0.9, 0.8, 1.1)
     thickness = 3 if res_4k else 2
 
-    cv2.putText(frame, label, (bbox[0], bbox[3] + text_pos[0]),
-                cv2.FONT_HERSHEY_SIMPLEX, font_size[0], (255, 255, 255), thickness)
-    cv2.putText(frame, f"{det_conf}", (bbox[0], bbox[3] + text_pos[1]),
-                cv2.FONT_HERSHEY_SIMPLEX, font_size[1], (255, 255, 255), thickness)
-    cv2.putText(frame, f"ID:{track_id}", (bbox[0], bbox[3] + text_pos[2]),
-                cv2.FONT_HERSHEY_SIMPLEX, font_size[2], (255, 255, 255), thickness)
-    cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), thickness)
-
-    if tracklet == tracks[-1]:
-        timestamp_overlay = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
-        path_overlay = f"{save_path}/overlay/{timestamp_overlay}_overlay.jpg"
-        cv2.imwrite(path_overlay, frame)
+    for bbox, label, det_conf, track_id in overlays:
+        cv2.putText(frame, label, (bbox[0], bbox[3] + text_pos[0]),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_size[0], (255, 255, 255), thickness)
+        cv2.putText(frame, f"{det_conf}", (bbox[0], bbox[3] + text_pos[1]),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_size[1], (255, 255, 255), thickness)
+        cv2.putText(frame, f"ID:{track_id}", (bbox[0], bbox[3] + text_pos[2]),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_size[2], (255, 255, 255), thickness)
+        cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), thickness)
+
+    timestamp = datetime.now() if timestamp is None else timestamp
+    timestamp_overlay = timestamp.strftime("%Y-%m-%d_%H-%M-%S-%f")
+    path_overlay = f"{save_path}/overlay/{timestamp_overlay}_overlay.jpg"
+    save_jpg(path_overlay, frame, zip_file)
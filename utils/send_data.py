@@ -7,6 +7,8 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+from utils.save_data import metadata_lock, zip_lock
+
 load_dotenv()
 
 CLASSIFICATION_ENDPOINT = os.getenv('CLASSIFICATION_ENDPOINT')
@@ -34,12 +36,17 @@ def post_with_retry(endpoint, payload, files):
     )
 
 
-def send_track_data(track_id, save_path, rec_start_format):
+def send_track_data(track_id, save_path, rec_start_format, zip_file=None):
 
     if not os.path.exists(os.path.join(save_path, f"{rec_start_format}_metadata.csv")):
         return
 
-    metadata = pd.read_csv(os.path.join(save_path, f"{rec_start_format}_metadata.csv"))
+    # Read metadata under lock to not parse a partially written row
+    with metadata_lock:
+        try:
+            metadata = pd.read_csv(os.path.join(save_path, f"{rec_start_format}_metadata.csv"))
+        except pd.errors.EmptyDataError:
+            return
 
     track_data = metadata[metadata['track_ID'] == track_id]
 
@@ -50,13 +57,21 @@ def send_track_data(track_id, save_path, rec_start_format):
     end_date = datetime.strptime(track_data['timestamp'].max(), '%Y-%m-%dT%H:%M:%S.%f')
     duration = int((end_date - start_date).total_seconds())
 
-    track_files = [f for f in os.listdir(os.path.join(save_path, 'crop', 'insect')) if f'ID{track_id}' in f.split('_')]
-    file_paths = [os.path.join(save_path, 'crop', 'insect', f) for f in track_files]
-
     endpoint = f'{CLASSIFICATION_ENDPOINT}/{track_id}'
 
     payload = {'start_date': start_date, 'end_date': end_date, 'duration_s': duration}
-    files = [('files', open(fp, 'rb')) for fp in file_paths]
+
+    if zip_file is None:
+        track_files = [f for f in os.listdir(os.path.join(save_path, 'crop', 'insect')) if f'ID{track_id}' in f.split('_')]
+        file_paths = [os.path.join(save_path, 'crop', 'insect', f) for f in track_files]
+        files = [('files', open(fp, 'rb')) for fp in file_paths]
+    else:
+        # Crops are stored in the .zip file of the recording during recording
+        crop_dir = f'{os.path.basename(save_path)}/crop/insect/'
+        with zip_lock:
+            files = [('files', (os.path.basename(name), zip_file.read(name)))
+                     for name in zip_file.namelist()
+                     if name.startswith(crop_dir) and f'ID{track_id}' in os.path.basename(name).split('_')]
 
     try:
         response = post_with_retry(endpoint, payload, files)
@@ -18,6 +18,10 @@ Docs:     https://maxsitt.github.io/insect-detect-docs/
 - synchronize tracker output (including detections) from inference on LQ frames with
   HQ frames (default: 1920x1080 px) on-device using the respective message timestamps
   -> pipeline speed (= inference speed): ~13.4 fps (1080p sync) or ~3.4 fps (4K sync)
+- forward HQ frames at the specified capture frequency (default: 1 s) on-device (script)
+  -> only HQ frames that are used on the host are encoded and sent via XLink
+- encode HQ frames to MJPEG on-device (video encoder) and only decode them on the host
+  if tracked detections are present (full frames are saved without re-encoding)
 - save detections (bounding box area) cropped from HQ frames to .jpg at the
   specified capture frequency (default: 1 s), optionally together with full frames
 - save corresponding metadata from tracker (+ model) output (time, label, confidence,
@@ -49,8 +53,9 @@ Docs:     https://maxsitt.github.io/insect-detect-docs/
              -> slightly decreases pipeline speed
   '-log'     write RPi CPU + OAK chip temperature and RPi available memory (MB) +
              CPU utilization (%) to .csv file at specified frequency
-  '-zip'     store all captured data in an uncompressed .zip file for each day
+  '-zip'     store all captured data in an uncompressed .zip file for each recording
              and delete original directory
+             -> images are written directly to the .zip file during recording
              -> increases file transfer speed from microSD to computer
                 but also on-device processing time and power consumption
 
@@ -58,23 +63,26 @@ based on open source scripts available at https://github.com/luxonis
 """
 
 import argparse
-from collections import defaultdict
+import csv
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import heapq
 import json
 import logging
+import shutil
 import subprocess
 import threading
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
+from zipfile import ZIP_STORED, ZipFile
 
+import cv2
 import depthai as dai
-import psutil
-from apscheduler.schedulers.background import BackgroundScheduler
 
-from utils.general import frame_norm, zip_data
+from utils.general import crop_bbox, frame_norm
 from utils.log import record_log, save_logs
 from utils.oak_cam import bbox_set_exposure_region, set_focus_range
-from utils.save_data import save_crop_metadata, save_full_frame, save_overlay_frame
+from utils.save_data import METADATA_FIELDS, flush_metadata, save_crop_metadata, save_full_frame, save_overlay_frame
 from utils.send_data import send_track_data
 
 # Define optional arguments
@@ -99,7 +107,7 @@ parser.add_argument("-log", "--save_logs", action="store_true",
     help=("Write RPi CPU + OAK chip temperature and RPi available memory (MB) + "
           "CPU utilization (%%) to .csv file."))
 parser.add_argument("-zip", "--zip_data", action="store_true",
-    help="Store data in an uncompressed .zip file for each day and delete original directory.")
+    help="Store data in an uncompressed .zip file for each recording and delete original directory.")
 args = parser.parse_args()
 
 REPOSITORY_NAME = "insect-detect-waskrabbeltda"
@@ -121,12 +129,25 @@ FULL_FREQ = 60
 # Set frequency for saving logs to .csv file if "-log" is used (default: 30 seconds)
 LOG_FREQ = 30
 
+# Set frequency for updating the free disk space during recording (default: 30 seconds)
+DISK_FREQ = 30
+
+# Set maximum number of pending saves in the thread pool (default: 8)
+# -> block processing of new frames if saving is slower, to limit memory usage of queued frames
+MAX_PENDING_SAVES = 8
+
 # Set recording time (default: 2 minutes)
 REC_TIME = args.min_rec_time * 60
 
 # Set threshold for removing lost tracklets from tracker output from our tracking
 LOST_FRAMES_TILL_REMOVAL = 10  # one second per frame
-lost_frames = defaultdict(int)
+lost_frames = {}  # number of consecutive frames each tracking ID was not tracked
+save_futures = []  # pending saves in the thread pool (cropped detections, full + overlay frames)
+crop_futures = []  # pending saves of cropped detections + metadata
+
+# Set tracking status values to compare with status of tracklets from tracker output
+TRACKED = dai.Tracklet.TrackingStatus.TRACKED
+REMOVED = dai.Tracklet.TrackingStatus.REMOVED
 
 # Set logging level and format, write logs to file
 Path(f"{REPOSITORY_NAME}/data").mkdir(parents=True, exist_ok=True)
@@ -136,7 +157,7 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s: %(m
 logger = logging.getLogger()
 
 # Shut down Raspberry Pi if free disk space (MB) is lower than threshold
-disk_free = round(psutil.disk_usage("/").free / 1048576)
+disk_free = shutil.disk_usage("/").free >> 20
 if disk_free < MIN_DISKSPACE:
     logger.info("Shut down without recording | Free disk space left: %s MB\n", disk_free)
     subprocess.run(["sudo", "shutdown", "-h", "now"], check=True)
@@ -170,9 +191,16 @@ confidence_threshold = nn_metadata.get("confidence_threshold", {})
 nn_mappings = config.get("mappings", {})
 labels = nn_mappings.get("labels", {})
 
+# Convert labels to tuple indexed by class ID (labels can also be a dict with class IDs as keys)
+if isinstance(labels, dict):
+    LABELS = tuple(labels[class_id] for class_id in sorted(labels, key=int))
+else:
+    LABELS = tuple(labels)
+
 # Create folders for each object class to save cropped detections
-for det_class in labels:
-    (save_path / f"crop/{det_class}").mkdir(parents=True, exist_ok=True)
+crop_dirs = {det_class: save_path / "crop" / det_class for det_class in LABELS}
+for crop_dir in crop_dirs.values():
+    crop_dir.mkdir(parents=True, exist_ok=True)
 
 # Create depthai pipeline
 pipeline = dai.Pipeline()
@@ -216,23 +244,36 @@ nn.passthrough.link(tracker.inputTrackerFrame)
 nn.passthrough.link(tracker.inputDetectionFrame)
 nn.out.link(tracker.inputDetections)
 
+# Create script node to forward HQ frames only at specified capture frequency
+script = pipeline.create(dai.node.Script)
+script.inputs["frames"].setBlocking(False)
+script.inputs["frames"].setQueueSize(1)
+cam_rgb.video.link(script.inputs["frames"])  # HQ frames
+script.setScript(f"""
+last_capture = -{CAPTURE_FREQ}
+while True:
+    frame = node.io["frames"].get()
+    timestamp = frame.getTimestamp().total_seconds()
+    if timestamp - last_capture >= {CAPTURE_FREQ}:
+        last_capture = timestamp
+        node.io["frames_capture"].send(frame)
+""")
+
+# Create and configure video encoder node and define input
+encoder = pipeline.create(dai.node.VideoEncoder)
+encoder.setDefaultProfilePreset(25, dai.VideoEncoderProperties.Profile.MJPEG)
+encoder.setQuality(95)
+script.outputs["frames_capture"].link(encoder.input)  # HQ frames at capture frequency
+
 # Create and configure sync node and define inputs
 sync = pipeline.create(dai.node.Sync)
 sync.setSyncThreshold(timedelta(milliseconds=200))
-cam_rgb.video.link(sync.inputs["frames"])  # HQ frames
+encoder.bitstream.link(sync.inputs["frames"])  # MJPEG-encoded HQ frames
 tracker.out.link(sync.inputs["tracker"])   # tracker output
 
-# Create message demux node and define input + outputs
-demux = pipeline.create(dai.node.MessageDemux)
-sync.out.link(demux.input)
-
-xout_rgb = pipeline.create(dai.node.XLinkOut)
-xout_rgb.setStreamName("frame")
-demux.outputs["frames"].link(xout_rgb.input)  # synced HQ frames
-
-xout_tracker = pipeline.create(dai.node.XLinkOut)
-xout_tracker.setStreamName("track")
-demux.outputs["tracker"].link(xout_tracker.input)  # synced tracker output
+xout_sync = pipeline.create(dai.node.XLinkOut)
+xout_sync.setStreamName("sync")
+sync.out.link(xout_sync.input)  # message group with synced HQ frame + tracker output
 
 if args.af_range or args.bbox_ae_region:
     # Create XLinkIn node to send control commands to color camera node
@@ -243,31 +284,32 @@ if args.af_range or args.bbox_ae_region:
 # Connect to OAK device and start pipeline in USB2 mode
 with dai.Device(pipeline, maxUsbSpeed=dai.UsbSpeed.HIGH) as device:
 
-    if args.save_logs or (args.save_full_frames == "freq"):
-        logging.getLogger("apscheduler").setLevel(logging.WARNING)
-        scheduler = BackgroundScheduler()
-    else:
-        scheduler = None
-
-    if args.save_logs:
-        # Write RPi + OAK info to .csv file at specified frequency
-        scheduler.add_job(save_logs, "interval", seconds=LOG_FREQ, id="log",
-                          args=[device, rec_id, rec_start, save_path])
-        scheduler.start()
-
-    if args.save_full_frames == "freq":
-        # Save full HQ frame at specified frequency
-        scheduler.add_job(save_full_frame, "interval", seconds=FULL_FREQ, id="full",
-                          args=[None, save_path])
-        if not scheduler.running:
-            scheduler.start()
+    def update_disk_free():
+        """Update free disk space (MB)."""
+        global disk_free
+        disk_free = shutil.disk_usage("/").free >> 20
+
+    def run_due_jobs():
+        """Run all scheduled jobs that are due and schedule their next run."""
+        now = time.monotonic()
+        while jobs[0][0] <= now:
+            next_run, job_id, interval, job_func, job_args = heapq.heappop(jobs)
+            try:
+                job_func(*job_args)
+            except Exception:
+                # Write info on error + traceback of scheduled job to log file and keep recording
+                logger.exception("Error during scheduled job %s in recording %s", job_func.__name__, rec_id)
+            next_run += interval
+            if next_run <= now:
+                # Skip missed runs if job was delayed for longer than its interval
+                next_run = now + interval
+            heapq.heappush(jobs, (next_run, job_id, interval, job_func, job_args))
 
     # Write info on start of recording to log file
     logger.info("Rec ID: %s | Rec time: %s min", rec_id, int(REC_TIME / 60))
 
-    # Create output queues to get the frames and tracklets (+ detections) from the outputs defined above
-    q_frame = device.getOutputQueue(name="frame", maxSize=4, blocking=False)
-    q_track = device.getOutputQueue(name="track", maxSize=4, blocking=False)
+    # Create output queue to get the synced frames and tracklets (+ detections) from the output defined above
+    q_sync = device.getOutputQueue(name="sync", maxSize=4, blocking=False)
 
     if args.af_range or args.bbox_ae_region:
         # Create input queue to send control commands to OAK camera
@@ -278,107 +320,198 @@ with dai.Device(pipeline, maxUsbSpeed=dai.UsbSpeed.HIGH) as device:
         af_ctrl = set_focus_range(args.af_range[0], args.af_range[1])
         q_ctrl.send(af_ctrl)
 
-    # Set start time of recording and create empty list to save threads
+    # Set start time of recording, create thread pools to save frames and to send track data
+    # and create event to stop the recording early (e.g. if an error occurs)
     start_time = time.monotonic()
-    threads = []
+    io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="saver")
+    upload_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="uploader")
+    stop_event = threading.Event()
+
+    # Open metadata .csv file once for the whole recording (flushed after each frame)
+    # and write header if the file is new
+    metadata_file = open(save_path / f"{rec_start_format}_metadata.csv", "a",
+                         encoding="utf-8", buffering=65536)
+    if metadata_file.tell() == 0:
+        csv.DictWriter(metadata_file, fieldnames=METADATA_FIELDS).writeheader()
+
+    # Set .zip file of the recording (opened if data is zipped) and ID of the callback
+    # that processes synced messages (both are set when the recording starts)
+    zip_file = None
+    callback_id = None
+
+    def log_future_error(future):
+        """Write info on error + traceback of a failed task in a thread pool to log file."""
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Error in thread pool during recording %s", rec_id, exc_info=future.exception())
+
+    def submit_save(save_func, *args, **kwargs):
+        """Submit save to thread pool and wait if the maximum number of pending saves is reached."""
+        save_futures[:] = [future for future in save_futures if not future.done()]
+        if len(save_futures) >= MAX_PENDING_SAVES:
+            wait(save_futures, return_when=FIRST_COMPLETED)
+        future = io_pool.submit(save_func, *args, **kwargs)
+        future.add_done_callback(log_future_error)
+        save_futures.append(future)
+        return future
+
+    def send_removed_tracks(track_ids, pending_crop_futures):
+        """Send data of removed tracks to API after all pending crops + metadata are saved."""
+        wait(pending_crop_futures)
+        flush_metadata(metadata_file)
+        for track_id in track_ids:
+            print("Removing ", track_id)
+            send_track_data(track_id, save_path, rec_start_format, zip_file)
+
+    def on_sync(msg_sync):
+        """Save cropped detections + metadata from HQ frame at specified capture frequency."""
+        try:
+            # Get synchronized MJPEG-encoded HQ frame + tracker output (including passthrough detections)
+            frame_jpg = msg_sync["frames"].getData()
+            tracks = msg_sync["tracker"].tracklets
+
+            # Only use tracklets that are currently tracked (not "NEW", "LOST" or "REMOVED")
+            tracks_tracked = [tracklet for tracklet in tracks if tracklet.status == TRACKED]
+
+            if args.save_full_frames == "freq":
+                # Update latest full HQ frame that is saved at specified frequency
+                full_frame_args[0] = frame_jpg
+
+            if tracks_tracked:
+                # Decode HQ frame only if it is required to crop detections
+                frame_hq = cv2.imdecode(frame_jpg, cv2.IMREAD_COLOR)
+
+                # Get bounding boxes from passthrough detections and convert all at once
+                bboxes_orig = [(tracklet.srcImgDetection.xmin, tracklet.srcImgDetection.ymin,
+                                tracklet.srcImgDetection.xmax, tracklet.srcImgDetection.ymax)
+                               for tracklet in tracks_tracked]
+                bboxes_norm = frame_norm(frame_hq, bboxes_orig)
+
+            # Get timestamp once per frame, shared by all images + metadata saved from this frame
+            frame_timestamp = datetime.now()
+
+            # Get index of latest tracked tracklet (ignoring trailing "NEW", "LOST" or "REMOVED")
+            last_idx = len(tracks_tracked) - 1
+
+            # Create empty list to collect overlays (bbox + info) of all detections in frame
+            overlays = []
+
+            for i, tracklet in enumerate(tracks_tracked):
+                bbox_orig = bboxes_orig[i]
+                bbox_norm = bboxes_norm[i]
+
+                # Get metadata from tracker output (including passthrough detections)
+                det = tracklet.srcImgDetection
+                label = LABELS[det.label]
+                det_conf = round(det.confidence, 2)
+                track_id = tracklet.id
+
+                if args.bbox_ae_region and i == last_idx:
+                    # Use model bbox from latest tracking ID to set auto exposure region
+                    ae_ctrl = bbox_set_exposure_region(bbox_orig, SENSOR_RES)
+                    q_ctrl.send(ae_ctrl)
+
+                # Save detection cropped from HQ frame together with metadata
+                bbox_crop = crop_bbox(frame_hq, bbox_norm, args.crop_bbox)
+                crop_futures.append(
+                    submit_save(save_crop_metadata, bbox_crop, crop_dirs[label], rec_id, label,
+                                det_conf, track_id, bbox_orig, rec_start_format, save_path,
+                                metadata_file=metadata_file, zip_file=zip_file,
+                                timestamp=frame_timestamp))
+
+                if args.save_full_frames == "det" and i == last_idx:
+                    # Save full HQ frame
+                    submit_save(save_full_frame, frame_jpg, save_path, zip_file, frame_timestamp)
+
+                if args.save_overlay_frames:
+                    # Add overlay (bbox + info) of detection
+                    overlays.append((bbox_norm, label, det_conf, track_id))
+
+            if overlays:
+                # Save full HQ frame with overlays of all detections
+                # (draw directly on decoded HQ frame, as cropped detections are copied)
+                submit_save(save_overlay_frame, frame_hq, overlays,
+                            save_path, args.four_k_resolution, zip_file, frame_timestamp)
+
+            # Logic to send newly lost tracking id images to API
+            # We experienced inconsistent behaviour when only depending on the status of the tracklet turning to REMOVED
+            # Therefore we also perform our own tracking of currently tracked tracklets
+            # And if a tracklet has not been tracked for the last LOST_FRAMES_TILL_REMOVAL frames, we remove it
+            # The value of LOST_FRAMES_TILL_REMOVAL is a tradeoff between having quick uploads to the dashboard
+            # once an insect has left the camera and not tracking an insect twice
+            removed_ids = {tracklet.id for tracklet in tracks if tracklet.status == REMOVED}
+            current_track_ids = {tracklet.id for tracklet in tracks if tracklet.status == TRACKED}
+            print(f"Current track ids: {current_track_ids}")
+            print(f"Removed ids: {removed_ids}")
+
+            ids_to_remove = []
+            for track_id, lost_count in lost_frames.items():
+                if track_id in current_track_ids:
+                    lost_frames[track_id] = 0
+                else:
+                    lost_frames[track_id] = lost_count + 1
+                    if lost_count + 1 >= LOST_FRAMES_TILL_REMOVAL or track_id in removed_ids:
+                        ids_to_remove.append(track_id)
+
+            for track_id in current_track_ids:
+                if track_id not in lost_frames:
+                    lost_frames[track_id] = 0
+
+            # Forget futures of crops that are already saved
+            crop_futures[:] = [future for future in crop_futures if not future.done()]
+
+            # Write buffered metadata of saved detections to .csv file
+            flush_metadata(metadata_file)
+
+            if ids_to_remove:
+                # Send data of removed tracks in separate thread (without blocking the callback),
+                # after all crops + metadata that are still pending are saved
+                upload_future = upload_pool.submit(send_removed_tracks, ids_to_remove, list(crop_futures))
+                upload_future.add_done_callback(log_future_error)
+                crop_futures.clear()
+
+            for track_id in ids_to_remove:
+                lost_frames.pop(track_id, None)
+
+            print(lost_frames.items())
+
+        except Exception:
+            # Write info on error + traceback during recording to log file and stop recording
+            logger.exception("Error during recording %s", rec_id)
+            stop_event.set()
 
     try:
+        if args.zip_data:
+            # Open uncompressed .zip file for this recording to store images directly during recording
+            # (not the .zip file of the day, so that a crash only affects this recording)
+            zip_file = ZipFile(f"{save_path}.zip", "w", compression=ZIP_STORED)
+
+        # Create heap of scheduled jobs (next run, job ID, interval, job function, job arguments)
+        # that are run from the main loop, starting with updating free disk space (MB)
+        jobs = [(time.monotonic() + DISK_FREQ, 0, DISK_FREQ, update_disk_free, [])]
+
+        if args.save_logs:
+            # Write RPi + OAK info to .csv file at specified frequency
+            jobs.append((time.monotonic() + LOG_FREQ, 1, LOG_FREQ, save_logs,
+                         [device, rec_id, rec_start, save_path]))
+
+        if args.save_full_frames == "freq":
+            # Save latest full HQ frame at specified frequency (frame is updated in callback)
+            full_frame_args = [None, save_path, zip_file]
+            jobs.append((time.monotonic() + FULL_FREQ, 2, FULL_FREQ, save_full_frame, full_frame_args))
+
+        heapq.heapify(jobs)
+
+        # Process synced messages as soon as they are received from the OAK device
+        callback_id = q_sync.addCallback(on_sync)
+
         # Record until recording time is finished
-        # Stop recording early if free disk space drops below threshold
+        # Stop recording early if free disk space drops below threshold or if an error occurs
         while time.monotonic() < start_time + REC_TIME and disk_free > MIN_DISKSPACE:
-            # Get synchronized HQ frame + tracker output (including passthrough detections)
-            if q_frame.has() and q_track.has():
-                frame_hq = q_frame.get().getCvFrame()
-                tracks = q_track.get().tracklets
+            run_due_jobs()
 
-                if args.save_full_frames == "freq":
-                    # Save full HQ frame at specified frequency
-                    scheduler.modify_job("full", args=[frame_hq, save_path])
-
-                if args.save_overlay_frames:
-                    # Copy frame for drawing overlays
-                    frame_hq_copy = frame_hq.copy()
-
-                for tracklet in tracks:
-                    print(tracklet.id, tracklet.status.name)
-                    # Only use tracklets that are currently tracked (not "NEW", "LOST" or "REMOVED")
-                    if tracklet.status.name == "TRACKED":
-                        # Get bounding box from passthrough detections
-                        bbox_orig = (tracklet.srcImgDetection.xmin, tracklet.srcImgDetection.ymin,
-                                     tracklet.srcImgDetection.xmax, tracklet.srcImgDetection.ymax)
-                        bbox_norm = frame_norm(frame_hq, bbox_orig)
-
-                        # Get metadata from tracker output (including passthrough detections)
-                        label = labels[tracklet.srcImgDetection.label]
-                        det_conf = round(tracklet.srcImgDetection.confidence, 2)
-                        track_id = tracklet.id
-
-                        if args.bbox_ae_region and tracklet == tracks[-1]:
-                            # Use model bbox from latest tracking ID to set auto exposure region
-                            ae_ctrl = bbox_set_exposure_region(bbox_orig, SENSOR_RES)
-                            q_ctrl.send(ae_ctrl)
-
-                        # Save detections cropped from HQ frame together with metadata
-                        save_crop_metadata(frame_hq, bbox_norm, rec_id, label, det_conf, track_id,
-                                           bbox_orig, rec_start_format, save_path, args.crop_bbox)
-
-                        if args.save_full_frames == "det" and tracklet == tracks[-1]:
-                            # Save full HQ frame
-                            thread_full = threading.Thread(target=save_full_frame,
-                                                           args=(frame_hq, save_path))
-                            thread_full.start()
-                            threads.append(thread_full)
-
-                        if args.save_overlay_frames:
-                            # Save full HQ frame with overlays
-                            thread_overlay = threading.Thread(target=save_overlay_frame,
-                                                              args=(frame_hq_copy, bbox_norm, label,
-                                                                    det_conf, track_id, tracklet, tracks,
-                                                                    save_path, args.four_k_resolution))
-                            thread_overlay.start()
-                            threads.append(thread_overlay)
-
-                    # Logic to send newly lost tracking id images to API
-                    # We experienced inconsistent behaviour when only depending on the status of the tracklet turning to REMOVED
-                    # Therefore we also perform our own tracking of currently tracked tracklets
-                    # And if a tracklet has not been tracked for the last LOST_FRAMES_TILL_REMOVAL frames, we remove it
-                    # The value of LOST_FRAMES_TILL_REMOVAL is a tradeoff between having quick uploads to the dashboard
-                    # once an insect has left the camera and not tracking an insect twice
-                    removed_ids = [
-                        tracklet.id
-                        for tracklet in tracks
-                        if tracklet.status.name == "REMOVED"
-                    ]
-                    current_track_ids = [tracklet.id for tracklet in tracks if tracklet.status.name == 'TRACKED']
-                    print(f"Current track ids: {current_track_ids}")
-                    print(f"Removed ids: {removed_ids}")
-
-                    lost_ids = set(lost_frames.keys()) - set(current_track_ids)
-                    print(f"Lost ids: {lost_ids}")
-
-                    for track_id in current_track_ids:
-                        lost_frames[track_id] = 0
-
-                    for track_id in lost_ids:
-                        lost_frames[track_id] += 1
-                        if (
-                            lost_frames[track_id] >= LOST_FRAMES_TILL_REMOVAL
-                            or track_id in removed_ids
-                        ):
-                            print("Removing ", track_id, tracklet.status.name)
-                            send_track_data(track_id, save_path, rec_start_format)
-                            del lost_frames[track_id]
-
-                    print(lost_frames.items())
-
-            # Update free disk space (MB)
-            disk_free = round(psutil.disk_usage("/").free / 1048576)
-
-            # Keep only active threads in list
-            threads = [thread for thread in threads if thread.is_alive()]
-
-            # Wait for specified amount of seconds (default: 1)
-            time.sleep(CAPTURE_FREQ)
+            # Wait until next job is due (or recording time is finished)
+            if stop_event.wait(timeout=min(jobs[0][0], start_time + REC_TIME) - time.monotonic()):
+                break
 
         # Write info on end of recording to log file
         logger.info("Recording %s finished\n", rec_id)
@@ -392,21 +525,30 @@ with dai.Device(pipeline, maxUsbSpeed=dai.UsbSpeed.HIGH) as device:
     #     logger.exception("Error during recording %s", rec_id)
 
     finally:
-        # Shut down scheduler (wait until currently executing jobs are finished)
-        if scheduler:
-            scheduler.shutdown()
+        if callback_id is not None:
+            # Stop processing of received synced messages
+            q_sync.removeCallback(callback_id)
+
+        # Wait for submitted frames to be saved and track data to be sent and shut down thread pools
+        io_pool.shutdown(wait=True)
+        upload_pool.shutdown(wait=True)
 
-        # Wait for active threads to finish
-        for thread in threads:
-            thread.join()
+        # Close metadata .csv file
+        metadata_file.close()
+
+        if zip_file is not None:
+            # Store remaining data (metadata .csv) in .zip file of the recording and close it
+            for file in save_path.rglob("*"):
+                zip_file.write(file, file.relative_to(save_path.parent))
+            zip_file.close()
 
         # Write record logs to .csv file
         rec_end = datetime.now()
         record_log(rec_id, rec_start, rec_start_format, rec_end, save_path)
 
-        if args.zip_data:
-            # Store data in uncompressed .zip file and delete original folder
-            zip_data(save_path)
+        if zip_file is not None:
+            # Delete original folder (all data is stored in .zip file of the recording)
+            shutil.rmtree(save_path, ignore_errors=True)
 
         # Shut down Raspberry Pi
         # subprocess.run(["sudo", "shutdown", "-h", "now"], check=True)
@@ -71,7 +71,7 @@ import psutil
 from apscheduler.schedulers.background import BackgroundScheduler
 from pijuice import PiJuice
 
-from utils.general import frame_norm, zip_data
+from utils.general import crop_bbox, frame_norm, zip_data
 from utils.log import record_log, save_logs
 from utils.oak_cam import bbox_set_exposure_region, set_focus_range
 from utils.save_data import save_crop_metadata, save_full_frame, save_overlay_frame
@@ -310,10 +310,13 @@ with dai.Device(pipeline, maxUsbSpeed=dai.UsbSpeed.HIGH) as device:
                     # Save full HQ frame at specified frequency
                     scheduler.modify_job("full", args=[frame_hq, save_path])
 
-                if args.save_overlay_frames:
-                    # Copy frame for drawing overlays
+                if args.save_overlay_frames and any(tracklet.status.name == "TRACKED" for tracklet in tracks):
+                    # Copy frame for drawing overlays (only if it contains tracked detections)
                     frame_hq_copy = frame_hq.copy()
 
+                # Create empty list to collect overlays (bbox + info) of all detections in frame
+                overlays = []
+
                 for tracklet in tracks:
                     # Only use tracklets that are currently tracked (not "NEW", "LOST" or "REMOVED")
                     print(tracklet.id, tracklet.status.name)
@@ -334,8 +337,9 @@ with dai.Device(pipeline, maxUsbSpeed=dai.UsbSpeed.HIGH) as device:
                             q_ctrl.send(ae_ctrl)
 
                         # Save detections cropped from HQ frame together with metadata
-                        save_crop_metadata(frame_hq, bbox_norm, rec_id, label, det_conf, track_id,
-                                           bbox_orig, rec_start_format, save_path, args.crop_bbox)
+                        bbox_crop = crop_bbox(frame_hq, bbox_norm, args.crop_bbox)
+                        save_crop_metadata(bbox_crop, save_path / "crop" / label, rec_id, label,
+                                           det_conf, track_id, bbox_orig, rec_start_format, save_path)
 
                         if args.save_full_frames == "det" and tracklet == tracks[-1]:
                             # Save full HQ frame
@@ -345,17 +349,20 @@ with dai.Device(pipeline, maxUsbSpeed=dai.UsbSpeed.HIGH) as device:
                             threads.append(thread_full)
 
                         if args.save_overlay_frames:
-                            # Save full HQ frame with overlays
-                            thread_overlay = threading.Thread(target=save_overlay_frame,
-                                                              args=(frame_hq_copy, bbox_norm, label,
-                                                                    det_conf, track_id, tracklet, tracks,
-                                                                    save_path, args.four_k_resolution))
-                            thread_overlay.start()
-                            threads.append(thread_overlay)
+                            # Add overlay (bbox + info) of detection
+                            overlays.append((bbox_norm, label, det_conf, track_id))
 
                     if tracklet.status.name == "REMOVED":
                         send_track_data(tracklet.id, save_path, rec_start_format)
 
+                if overlays:
+                    # Save full HQ frame with overlays of all detections
+                    thread_overlay = threading.Thread(target=save_overlay_frame,
+                                                      args=(frame_hq_copy, overlays,
+                                                            save_path, args.four_k_resolution))
+                    thread_overlay.start()
+                    threads.append(thread_overlay)
+
             # Update free disk space (MB)
             disk_free = round(psutil.disk_usage("/").free / 1048576)
 